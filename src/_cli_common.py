@@ -0,0 +1,129 @@
+"""Command-line plumbing shared by the agent provisioning scripts."""
+
+import argparse
+import logging
+import sys
+
+from azure.core.credentials import TokenCredential
+from azure.identity import (AzureCliCredential, DefaultAzureCredential,
+                            EnvironmentCredential, ManagedIdentityCredential)
+
+
+def build_base_parser(
+    description: str, debug_help: str, verbose_help: str
+) -> argparse.ArgumentParser:
+    """
+    Build a parser with the arguments common to both provisioning scripts.
+
+    --debug and --verbose mean different things in each script, so callers
+    supply their help text. Callers add their script-specific arguments to
+    the returned parser.
+    """
+    p = argparse.ArgumentParser(description=description)
+
+    # Required args
+    p.add_argument(
+        "--ai-foundry-project-endpoint",
+        required=True,
+        help="AI Foundry project endpoint URL",
+    )
+    p.add_argument(
+        "--ai-model-deployment-name",
+        required=True,
+        help="Model deployment name (e.g. gpt-4o)",
+    )
+    p.add_argument(
+        "--databricks-workspace-url",
+        required=True,
+        help=(
+            "Databricks workspace URL "
+            "(e.g., https://adb-1234567890123456.azuredatabricks.net)"
+        ),
+    )
+
+    # Optional args
+    p.add_argument(
+        "--agent-name",
+        default="DatabricksVectorSearchAgent",
+        help="Name for the agent (default: DatabricksVectorSearchAgent)",
+    )
+    p.add_argument(
+        "--auth-source",
+        choices=["cli", "mi", "env"],
+        help=(
+            "Use only this Azure credential source (Azure CLI, managed "
+            "identity or environment) instead of DefaultAzureCredential"
+        ),
+    )
+    p.add_argument(
+        "--managed-identity-client-id",
+        help=(
+            "Client ID of a user-assigned managed identity (with "
+            "--auth-source mi or the default credential chain)"
+        ),
+    )
+    p.add_argument(
+        "--debug",
+        action="store_true",
+        help=debug_help,
+    )
+    p.add_argument(
+        "--verbose",
+        "-v",
+        action="store_true",
+        help=verbose_help,
+    )
+
+    return p
+
+
+def check_auth_args(
+    parser: argparse.ArgumentParser, args: argparse.Namespace
+) -> None:
+    """Reject auth options that the chosen auth source would ignore."""
+    if args.managed_identity_client_id and args.auth_source in ("cli", "env"):
+        parser.error(
+            "--managed-identity-client-id cannot be used with "
+            f"--auth-source {args.auth_source}"
+        )
+
+
+def build_credential(
+    auth_source: str | None = None,
+    managed_identity_client_id: str | None = None,
+) -> TokenCredential:
+    """
+    Build the Azure credential used by the scripts.
+
+    An explicit auth source skips the DefaultAzureCredential chain entirely.
+    Otherwise the chain runs without the interactive and IDE-specific
+    sources, which never apply to a CLI or pipeline run. A managed identity
+    client ID applies to the managed identity source and the default chain.
+    """
+    if managed_identity_client_id and auth_source in ("cli", "env"):
+        raise ValueError(
+            "A managed identity client ID cannot be used with "
+            f"auth source {auth_source!r}"
+        )
+    if auth_source == "cli":
+        return AzureCliCredential()
+    if auth_source == "mi":
+        return ManagedIdentityCredential(client_id=managed_identity_client_id)
+    if auth_source == "env":
+        return EnvironmentCredential()
+    return DefaultAzureCredential(
+        managed_identity_client_id=managed_identity_client_id,
+        exclude_interactive_browser_credential=True,
+        exclude_visual_studio_code_credential=True,
+        exclude_shared_token_cache_credential=True,
+        exclude_powershell_credential=True,
+    )
+
+
+def configure_logging(level: int = logging.INFO) -> None:
+    """Send log records at or above level to stderr."""
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
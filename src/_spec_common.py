@@ -0,0 +1,334 @@
+"""OpenAPI spec, agent and JSON helpers shared by the provisioning scripts."""
+
+import functools
+import hashlib
+import io
+import json
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from collections import Counter
+from collections.abc import Callable
+from pathlib import Path
+from typing import IO
+
+from azure.ai.agents import AgentsClient
+from azure.ai.agents.models import Agent
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib parser/encoder
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+SPEC_PATH = Path(__file__).parent / "azure_databricks_openapi_spec.json"
+
+# Databricks API areas the agent is documented to support (see
+# docs/API_COVERAGE.md); paths outside them, and components no kept path
+# references, are trimmed from the spec uploaded with the tool.
+TOOL_PATH_PREFIXES = (
+    "/api/2.0/clusters",
+    "/api/2.0/jobs",
+    "/api/2.0/workspace",
+    "/api/2.0/dbfs",
+    "/api/2.0/secrets",
+    "/api/2.0/libraries",
+    "/api/2.0/instance-pools",
+    "/api/2.0/repos",
+    "/api/2.0/sql/warehouses",
+    "/api/2.1/unity-catalog",
+    "/api/1.2/contexts",
+    "/api/1.2/commands",
+    "/api/2.0/vector-search",
+)
+
+# Bump whenever filter_spec (or anything else shaping the pickled spec)
+# changes, so caches written by older code are not served.
+_SPEC_CACHE_VERSION = 1
+
+
+def load_databricks_openapi_spec() -> dict:
+    """Load the Databricks OpenAPI spec, trimmed to the tool's API paths."""
+    if not SPEC_PATH.exists():
+        raise FileNotFoundError(
+            f"OpenAPI spec not found at {SPEC_PATH}. "
+            "Ensure azure_databricks_openapi_spec.json is in this directory."
+        )
+
+    # Reuse the trimmed spec from a pickle cache keyed by the source file's
+    # mtime and size so warm runs skip JSON parsing entirely and only ever
+    # materialize the paths the tool exposes.
+    stat = SPEC_PATH.stat()
+    cache_path = SPEC_PATH.with_name(
+        f"{SPEC_PATH.stem}.{stat.st_mtime_ns}.{stat.st_size}.pkl"
+    )
+    try:
+        with open(cache_path, "rb") as f:
+            cached_version, cached_prefixes, spec = pickle.load(f)
+        if (
+            cached_version == _SPEC_CACHE_VERSION
+            and cached_prefixes == TOOL_PATH_PREFIXES
+        ):
+            return spec
+    except FileNotFoundError:
+        pass
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError) as exc:
+        logger.debug("Ignoring unreadable spec cache %s: %s", cache_path, exc)
+
+    # Read the whole file as bytes and let the parser decode it in one pass
+    raw_spec = SPEC_PATH.read_bytes()
+    spec = orjson.loads(raw_spec) if orjson is not None else json.loads(raw_spec)
+
+    spec = filter_spec(spec)
+    _write_spec_cache(cache_path, spec)
+    return spec
+
+
+def _write_spec_cache(cache_path: Path, spec: dict) -> None:
+    """Atomically write the parsed spec cache, dropping stale entries."""
+    stem = cache_path.name.split(".", 1)[0]
+    try:
+        for stale in cache_path.parent.glob(f"{stem}.*.pkl"):
+            stale.unlink(missing_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+    except OSError as exc:
+        logger.debug("Could not write spec cache %s: %s", cache_path, exc)
+        return
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(
+                (_SPEC_CACHE_VERSION, TOOL_PATH_PREFIXES, spec),
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_name, cache_path)
+    except OSError as exc:
+        logger.debug("Could not write spec cache %s: %s", cache_path, exc)
+        Path(tmp_name).unlink(missing_ok=True)
+
+
+def filter_spec(
+    spec: dict, path_prefixes: tuple[str, ...] = TOOL_PATH_PREFIXES
+) -> dict:
+    """
+    Return a copy of the spec limited to paths under path_prefixes.
+
+    Components are kept only when reachable through a $ref from a kept path;
+    security schemes are always kept. Tags no operation uses are dropped.
+    """
+    paths = {
+        path: item
+        for path, item in spec.get("paths", {}).items()
+        if path.startswith(path_prefixes)
+    }
+    components = spec.get("components", {})
+
+    # Walk the kept paths, following $refs into components as they appear
+    referenced: set[tuple[str, str]] = set()
+    pending: list = [paths]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, list):
+            pending.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        ref = node.get("$ref")
+        if isinstance(ref, str) and ref.startswith("#/components/"):
+            section, _, name = ref.removeprefix("#/components/").partition("/")
+            if (section, name) not in referenced:
+                referenced.add((section, name))
+                target = components.get(section, {}).get(name)
+                if target is not None:
+                    pending.append(target)
+        pending.extend(node.values())
+
+    filtered_components = {}
+    for section, entries in components.items():
+        if section == "securitySchemes":
+            filtered_components[section] = entries
+            continue
+        kept = {
+            name: entry
+            for name, entry in entries.items()
+            if (section, name) in referenced
+        }
+        if kept:
+            filtered_components[section] = kept
+
+    filtered = {**spec, "paths": paths, "components": filtered_components}
+    if "tags" in spec:
+        used_tags = {
+            tag
+            for item in paths.values()
+            for operation in item.values()
+            if isinstance(operation, dict)
+            for tag in operation.get("tags", [])
+        }
+        filtered["tags"] = [
+            tag for tag in spec["tags"] if tag.get("name") in used_tags
+        ]
+    return filtered
+
+
+def inline_refs(spec: dict) -> None:
+    """
+    Replace single-use component $refs in the spec with their targets.
+
+    Resolving refs once here saves the service from doing it on every tool
+    call. Components referenced more than once stay as shared $refs so the
+    upload does not grow with a copy per use, and recursive refs cannot be
+    inlined; only the components still referenced (and security schemes)
+    are kept.
+    """
+    components = spec.get("components", {})
+
+    # Count every $ref occurrence; anything used twice or more is shared
+    ref_counts: Counter[str] = Counter()
+    pending: list = [spec]
+    while pending:
+        node = pending.pop()
+        if isinstance(node, list):
+            pending.extend(node)
+            continue
+        if not isinstance(node, dict):
+            continue
+        ref = node.get("$ref")
+        if isinstance(ref, str) and ref.startswith("#/components/"):
+            ref_counts[ref] += 1
+        pending.extend(node.values())
+    shared = {ref for ref, count in ref_counts.items() if count > 1}
+
+    unresolved: set[tuple[str, str]] = set()
+
+    def resolve(node, resolving: frozenset[str]):
+        if isinstance(node, list):
+            return [resolve(item, resolving) for item in node]
+        if not isinstance(node, dict):
+            return node
+        ref = node.get("$ref")
+        if isinstance(ref, str) and ref.startswith("#/components/"):
+            section, _, name = ref.removeprefix("#/components/").partition("/")
+            target = components.get(section, {}).get(name)
+            if target is None or ref in resolving or ref in shared:
+                unresolved.add((section, name))
+                return node
+            return resolve(target, resolving | {ref})
+        return {key: resolve(value, resolving) for key, value in node.items()}
+
+    for key in spec.keys() - {"components"}:
+        spec[key] = resolve(spec[key], frozenset())
+
+    kept_components = {}
+    if "securitySchemes" in components:
+        kept_components["securitySchemes"] = components["securitySchemes"]
+    done: set[tuple[str, str]] = set()
+    while unresolved - done:
+        section, name = (unresolved - done).pop()
+        done.add((section, name))
+        if name not in components.get(section, {}):
+            continue
+        ref = f"#/components/{section}/{name}"
+        kept_components.setdefault(section, {})[name] = resolve(
+            components[section][name], frozenset({ref})
+        )
+    spec["components"] = kept_components
+
+
+def customized_spec(
+    customize: Callable[[dict, str], dict], databricks_workspace_url: str
+) -> dict:
+    """
+    Return a fresh copy of the spec customized for a workspace.
+
+    The customized spec is cached per workspace URL and spec file version
+    (mtime and size), so repeated registrations (batch provisioning, tests)
+    skip the load and customize steps but still see edits to the file.
+    """
+    stat = SPEC_PATH.stat()
+    encoded = _customized_spec_bytes(
+        customize, databricks_workspace_url, stat.st_mtime_ns, stat.st_size
+    )
+    return orjson.loads(encoded) if orjson is not None else json.loads(encoded)
+
+
+@functools.lru_cache(maxsize=8)
+def _customized_spec_bytes(
+    customize: Callable[[dict, str], dict],
+    databricks_workspace_url: str,
+    spec_mtime_ns: int,
+    spec_size: int,
+) -> bytes:
+    """Customize the spec and cache it as immutable encoded JSON."""
+    return encode_json(
+        customize(load_databricks_openapi_spec(), databricks_workspace_url)
+    )
+
+
+def find_agent(client: AgentsClient, agent_name: str) -> Agent | None:
+    """
+    Return the agent named agent_name, or None if it does not exist.
+
+    The service cannot filter by name, so request the largest page size and
+    stop at the first match; later pages are only fetched if still needed.
+    """
+    for agent in client.list_agents(limit=100):
+        if agent.name == agent_name:
+            return agent
+    return None
+
+
+def tool_digest(tool: dict) -> str:
+    """Return a stable digest of a serialized tool definition."""
+    if orjson is not None:
+        data = orjson.dumps(tool, option=orjson.OPT_SORT_KEYS)
+    else:
+        # Match orjson's compact, non-ASCII-escaping output
+        data = json.dumps(
+            tool,
+            sort_keys=True,
+            separators=(",", ":"),
+            ensure_ascii=False,
+        ).encode()
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def json_body(payload: dict) -> dict | IO[bytes]:
+    """
+    Return an agent request body the SDK sends without re-serializing.
+
+    The SDK passes byte streams through as-is, so encoding with orjson here
+    replaces its slower pure-Python walk of the (large) tool spec.
+    """
+    if orjson is None:
+        return payload
+    return io.BytesIO(orjson.dumps(payload))
+
+
+def encode_json(payload: dict) -> bytes:
+    """Encode a request payload as compact UTF-8 JSON."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":")).encode()
+
+
+def emit_json(payload: dict) -> None:
+    """Write a payload to stdout as 2-space indented JSON."""
+    # A replaced stdout (e.g. redirect_stdout to a StringIO) has no buffer
+    buffer = getattr(sys.stdout, "buffer", None)
+    if orjson is None or buffer is None:
+        print(json.dumps(payload, indent=2))
+        return
+
+    # Write the encoded bytes directly, bypassing the text-layer re-encode
+    sys.stdout.flush()
+    buffer.write(
+        orjson.dumps(
+            payload, option=orjson.OPT_INDENT_2 | orjson.OPT_APPEND_NEWLINE
+        )
+    )
+    buffer.flush()
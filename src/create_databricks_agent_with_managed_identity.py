@@ -23,49 +23,51 @@ Example:
 """
 
 import argparse
-import json
 import logging
 import sys
-from pathlib import Path
+from typing import Final
 
 from azure.ai.agents.models import (OpenApiFunctionDefinition,
                                     OpenApiManagedAuthDetails,
                                     OpenApiManagedSecurityScheme,
                                     OpenApiToolDefinition)
 from azure.ai.projects import AIProjectClient
-from azure.identity import DefaultAzureCredential
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="[%(levelname)s] %(message)s",
-    stream=sys.stderr,
-)
+from _cli_common import (build_base_parser, build_credential,
+                         check_auth_args, configure_logging)
+from _spec_common import (customized_spec, emit_json, find_agent, inline_refs,
+                          json_body, tool_digest)
+
 logger = logging.getLogger(__name__)
 
+_MI_INSTRUCTIONS: Final[str] = """You are an AI assistant with access to Azure Databricks APIs.
 
-def load_databricks_openapi_spec() -> dict:
-    """Load the Databricks OpenAPI specification."""
-    script_dir = Path(__file__).parent
-    openapi_file = script_dir / "azure_databricks_openapi_spec.json"
-    if not openapi_file.exists():
-        raise FileNotFoundError(
-            f"Databricks OpenAPI spec not found: {openapi_file}"
-        )
-    with open(openapi_file, "r", encoding="utf-8") as f:
-        return json.load(f)
+You can help with:
+- Managing Databricks clusters (list, create, start, stop, delete)
+- Running and monitoring Databricks jobs
+- Managing workspace notebooks and files
+- Executing commands on clusters
+- Vector search operations (creating endpoints and indexes, querying vectors)
+
+When using the Databricks API:
+1. Always check cluster status before executing commands
+2. Use appropriate error handling
+3. For vector search, understand the difference between Delta Sync and Direct Access indexes
+4. Remember that authentication is handled automatically via managed identity
+
+Be helpful and provide clear explanations of what you're doing."""
 
 
 def customize_openapi_spec_for_workspace(
     spec: dict, databricks_workspace_url: str
 ) -> dict:
-    """Customize the OpenAPI spec with the specific workspace URL."""
-    customized_spec = spec.copy()
-
+    """Customize the OpenAPI spec in place with the specific workspace URL."""
     # Update the server URL with the actual workspace
-    if "servers" in customized_spec and len(customized_spec["servers"]) > 0:
-        customized_spec["servers"][0]["url"] = databricks_workspace_url
+    if "servers" in spec and len(spec["servers"]) > 0:
+        spec["servers"][0]["url"] = databricks_workspace_url
 
-    return customized_spec
+    inline_refs(spec)
+    return spec
 
 
 def register_databricks_openapi_tool(
@@ -73,6 +75,8 @@ def register_databricks_openapi_tool(
     databricks_workspace_url: str,
     agent_name: str,
     model_deployment_name: str,
+    auth_source: str | None = None,
+    managed_identity_client_id: str | None = None,
 ) -> str:
     """
     Register Databricks as an OpenAPI tool in AI Foundry agent.
@@ -81,16 +85,15 @@ def register_databricks_openapi_tool(
     """
     logger.info("Setting up Databricks OpenAPI tool with Managed Identity...")
 
-    credential = DefaultAzureCredential()
+    credential = build_credential(auth_source, managed_identity_client_id)
     project_client = AIProjectClient(
         credential=credential, endpoint=project_endpoint
     )
     client = project_client.agents
 
     # Load and customize OpenAPI spec
-    openapi_spec = load_databricks_openapi_spec()
-    openapi_spec = customize_openapi_spec_for_workspace(
-        openapi_spec, databricks_workspace_url
+    openapi_spec = customized_spec(
+        customize_openapi_spec_for_workspace, databricks_workspace_url
     )
 
     # Configure managed identity authentication
@@ -116,45 +119,49 @@ def register_databricks_openapi_tool(
 
     # Create or update agent
     logger.info(f"Creating/updating agent: {agent_name}")
-    agents = client.list_agents()
-    existing_agent = next((a for a in agents if a.name == agent_name), None)
-
-    instructions = """You are an AI assistant with access to Azure Databricks APIs.
-
-You can help with:
-- Managing Databricks clusters (list, create, start, stop, delete)
-- Running and monitoring Databricks jobs
-- Managing workspace notebooks and files
-- Executing commands on clusters
-- Vector search operations (creating endpoints and indexes, querying vectors)
-
-When using the Databricks API:
-1. Always check cluster status before executing commands
-2. Use appropriate error handling
-3. For vector search, understand the difference between Delta Sync and Direct Access indexes
-4. Remember that authentication is handled automatically via managed identity
-
-Be helpful and provide clear explanations of what you're doing."""
-
-    if existing_agent:
+    existing_agent = find_agent(client, agent_name)
+
+    description = "AI Agent with access to Azure Databricks APIs via Managed Identity"
+    # The digest lets reruns skip re-uploading an unchanged spec
+    tool_json = tool_definition.as_dict()
+    spec_digest = tool_digest(tool_json)
+    if (
+        existing_agent
+        and (existing_agent.metadata or {}).get("spec_digest") == spec_digest
+        and existing_agent.model == model_deployment_name
+        and existing_agent.description == description
+        and existing_agent.instructions == _MI_INSTRUCTIONS
+    ):
+        logger.info(f"Agent {existing_agent.id} is up to date (no-op)")
+        agent_id = existing_agent.id
+    elif existing_agent:
         logger.info(f"Updating existing agent: {existing_agent.id}")
         client.update_agent(
-            agent_id=existing_agent.id,
-            name=agent_name,
-            description="AI Agent with access to Azure Databricks APIs via Managed Identity",
-            instructions=instructions,
-            tools=[tool_definition],
-            model=model_deployment_name,
+            existing_agent.id,
+            json_body({
+                "name": agent_name,
+                "description": description,
+                "instructions": _MI_INSTRUCTIONS,
+                "tools": [tool_json],
+                "model": model_deployment_name,
+                "metadata": {
+                    **(existing_agent.metadata or {}),
+                    "spec_digest": spec_digest,
+                },
+            }),
         )
         agent_id = existing_agent.id
     else:
         logger.info(f"Creating new agent: {agent_name}")
         agent = client.create_agent(
-            model=model_deployment_name,
-            name=agent_name,
-            description="AI Agent with access to Azure Databricks APIs via Managed Identity",
-            instructions=instructions,
-            tools=[tool_definition],
+            json_body({
+                "model": model_deployment_name,
+                "name": agent_name,
+                "description": description,
+                "instructions": _MI_INSTRUCTIONS,
+                "tools": [tool_json],
+                "metadata": {"spec_digest": spec_digest},
+            })
         )
         agent_id = agent.id
 
@@ -163,70 +170,36 @@ Be helpful and provide clear explanations of what you're doing."""
 
 
 def parse_args(argv: list[str]) -> argparse.Namespace:
-    p = argparse.ArgumentParser(
+    p = build_base_parser(
         description=(
             "Create AI Foundry agent with Databricks access via Managed Identity. "
             "Print agent metadata as JSON."
-        )
-    )
-
-    # Required args
-    p.add_argument(
-        "--ai-foundry-project-endpoint",
-        required=True,
-        dest="ai_foundry_project",
-        help="AI Foundry project endpoint URL",
-    )
-    p.add_argument(
-        "--ai-model-deployment-name",
-        required=True,
-        dest="ai_model_deployment_name",
-        help="Model deployment name (e.g. gpt-4o)",
-    )
-    p.add_argument(
-        "--databricks-workspace-url",
-        required=True,
-        dest="databricks_workspace_url",
-        help="Databricks workspace URL (e.g., https://adb-1234567890123456.azuredatabricks.net)",
-    )
-
-    # Optional args
-    p.add_argument(
-        "--agent-name",
-        default="DatabricksVectorSearchAgent",
-        help="Name for the AI agent",
-    )
-    p.add_argument(
-        "--debug",
-        action="store_true",
-        help="Print full traceback on error",
-    )
-    p.add_argument(
-        "--verbose",
-        "-v",
-        action="store_true",
-        help="Enable verbose logging",
+        ),
+        debug_help="Print full traceback on error",
+        verbose_help="Enable verbose logging",
     )
-
-    return p.parse_args(argv)
+    args = p.parse_args(argv)
+    check_auth_args(p, args)
+    return args
 
 
 def main(argv: list[str]) -> int:
     args = parse_args(argv)
 
-    if args.verbose:
-        logging.getLogger().setLevel(logging.DEBUG)
+    configure_logging(logging.DEBUG if args.verbose else logging.INFO)
 
     try:
         agent_id = register_databricks_openapi_tool(
-            project_endpoint=args.ai_foundry_project,
+            project_endpoint=args.ai_foundry_project_endpoint,
             databricks_workspace_url=args.databricks_workspace_url,
             agent_name=args.agent_name,
             model_deployment_name=args.ai_model_deployment_name,
+            auth_source=args.auth_source,
+            managed_identity_client_id=args.managed_identity_client_id,
         )
 
         output_payload = {
-            "ai_foundry_project_endpoint": args.ai_foundry_project,
+            "ai_foundry_project_endpoint": args.ai_foundry_project_endpoint,
             "ai_model_deployment_name": args.ai_model_deployment_name,
             "ai_foundry_agent_id": agent_id,
             "agent_name": args.agent_name,
@@ -236,7 +209,7 @@ def main(argv: list[str]) -> int:
         }
 
         logger.info("Emitting agent configuration JSON")
-        print(json.dumps(output_payload, indent=2))
+        emit_json(output_payload)
         return 0
 
     except Exception as ex:
@@ -32,10 +32,16 @@ Provide an existing PAT instead of creating a new one:
             --databricks-pat <existing-pat-token>
 """
 
-import argparse
+import base64
 import json
 import logging
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Final
 
 import requests
 from azure.ai.agents.models import (OpenApiConnectionAuthDetails,
@@ -43,18 +49,176 @@ from azure.ai.agents.models import (OpenApiConnectionAuthDetails,
                                     OpenApiFunctionDefinition,
                                     OpenApiToolDefinition)
 from azure.ai.projects import AIProjectClient
-from azure.identity import DefaultAzureCredential
+from azure.core.credentials import AccessToken, TokenCredential
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from _cli_common import (build_base_parser, build_credential,
+                         check_auth_args, configure_logging)
+from _spec_common import (customized_spec, emit_json, encode_json,
+                          find_agent, inline_refs, json_body, tool_digest)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO, format="[%(levelname)s] %(message)s"
-)
 logger = logging.getLogger(__name__)
 
+_PAT_INSTRUCTIONS: Final[str] = (
+    "You are a helpful AI assistant with access to Azure Databricks. "
+    "You can help users interact with Databricks resources including "
+    "clusters, jobs, workspaces and vector search endpoints. "
+    "When users ask about Databricks resources, use the "
+    "databricks_api tool to retrieve information."
+)
+
+# Pooled HTTPS session shared by the Databricks and management API calls.
+# Retries only apply to idempotent methods, so PAT creation is never repeated.
+# Each host sees a single request per run, so HTTP/2 multiplexing (which is
+# per origin) would not save a handshake; HTTP/1.1 keep-alive is sufficient.
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=8,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False,
+        ),
+    ),
+)
+
+# Access tokens per credential and scope, reused until shortly before they
+# expire. Keyed weakly by credential so one identity's token is never handed
+# to another and entries go away with their credential.
+_TOKEN_CACHE: weakref.WeakKeyDictionary[
+    TokenCredential, dict[str, AccessToken]
+] = weakref.WeakKeyDictionary()
+
+# On-disk token cache used with --token-cache
+_TOKEN_CACHE_PATH = (
+    Path.home() / ".cache" / "ai-foundry-databricks" / "token.json"
+)
+
+
+class _PersistentTokenCredential:
+    """
+    Wrap a credential, persisting its access tokens to a private local file.
+
+    Tokens are keyed by the configured identity (auth source, managed
+    identity client ID, AZURE_CLIENT_ID), tenant and scopes, and reused
+    across runs until two minutes before expiry. Each entry also records the
+    token's oid/tid claims. The first request of a run always goes to the
+    real credential to learn the signed-in principal, so entries issued to a
+    different account (e.g. after az login as another user) are never reused.
+    """
+
+    def __init__(
+        self,
+        credential: TokenCredential,
+        auth_source: str | None = None,
+        managed_identity_client_id: str | None = None,
+        path: Path = _TOKEN_CACHE_PATH,
+    ):
+        self._credential = credential
+        self._identity = "|".join(
+            (
+                auth_source or "default",
+                managed_identity_client_id or "",
+                os.environ.get("AZURE_CLIENT_ID", ""),
+            )
+        )
+        self._path = path
+        self._lock = threading.Lock()
+        # (oid, tid) of the signed-in principal, known after the first fetch
+        self._principal: list[str] | None = None
+        self._principal_known = False
+
+    def get_token(self, *scopes: str, **kwargs) -> AccessToken:
+        # Claims challenges need a fresh token from the real credential
+        if kwargs.get("claims"):
+            return self._credential.get_token(*scopes, **kwargs)
+
+        tenant_id = kwargs.get("tenant_id") or os.environ.get(
+            "AZURE_TENANT_ID", ""
+        )
+        key = f"{self._identity}|{tenant_id}|{' '.join(sorted(scopes))}"
+        with self._lock:
+            entry = self._load().get(key)
+            principal_known = self._principal_known
+            principal = self._principal
+        if (
+            entry
+            and principal_known
+            and entry["expires_on"] - 120 > time.time()
+            and entry.get("principal") == principal
+        ):
+            return AccessToken(entry["token"], entry["expires_on"])
+
+        token = self._credential.get_token(*scopes, **kwargs)
+        principal = _token_principal(token.token)
+        with self._lock:
+            self._principal = principal
+            self._principal_known = True
+            # Drop expired entries and any issued to a different principal,
+            # e.g. after switching accounts under the same configuration
+            entries = {
+                cached_key: cached
+                for cached_key, cached in self._load().items()
+                if cached["expires_on"] > time.time()
+                and cached.get("principal") == principal
+            }
+            entries[key] = {
+                "token": token.token,
+                "expires_on": token.expires_on,
+                "principal": principal,
+            }
+            self._save(entries)
+        return token
+
+    def _load(self) -> dict:
+        try:
+            return json.loads(self._path.read_bytes())
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries: dict) -> None:
+        try:
+            self._path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+            tmp_path = self._path.with_suffix(".tmp")
+            fd = os.open(
+                tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.replace(tmp_path, self._path)
+        except OSError as exc:
+            logger.debug("Could not write token cache %s: %s", self._path, exc)
+
+
+def _token_principal(token: str) -> list[str] | None:
+    """Return the [oid, tid] claims of a JWT access token, if readable."""
+    try:
+        payload = token.split(".")[1]
+        padded = payload + "=" * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(padded))
+        return [claims["oid"], claims["tid"]]
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def _get_token(credential: TokenCredential, scope: str) -> AccessToken:
+    """Return an access token for scope, reusing a cached one if valid."""
+    tokens = _TOKEN_CACHE.setdefault(credential, {})
+    token = tokens.get(scope)
+    if token is None or token.expires_on - 60 < time.time():
+        token = credential.get_token(scope)
+        tokens[scope] = token
+    return token
+
 
 def create_databricks_pat(
     databricks_workspace_url: str,
-    credential: DefaultAzureCredential,
+    credential: TokenCredential,
     comment: str = "AI Foundry Agent",
     lifetime_days: int = 90,
 ) -> str:
@@ -73,8 +237,8 @@ def create_databricks_pat(
     logger.info("Creating Databricks Personal Access Token...")
 
     # Get Azure AD token for Databricks
-    token = credential.get_token(
-        "2ff814a6-3304-4ab8-85cb-cd0e6f879c1d/.default"
+    token = _get_token(
+        credential, "2ff814a6-3304-4ab8-85cb-cd0e6f879c1d/.default"
     ).token
 
     # Create PAT using Databricks API
@@ -90,7 +254,9 @@ def create_databricks_pat(
         "lifetime_seconds": lifetime_seconds,
     }
 
-    response = requests.post(url, headers=headers, json=payload, timeout=30)
+    response = _SESSION.post(
+        url, headers=headers, data=encode_json(payload), timeout=30
+    )
 
     if response.status_code != 200:
         error_msg = (
@@ -114,12 +280,14 @@ def create_databricks_pat(
 
 
 def create_ai_foundry_connection(
+    credential: TokenCredential,
     connection_name: str,
     databricks_pat: str,
     subscription_id: str,
     resource_group: str,
     account_name: str,
     project_name: str,
+    token: AccessToken | None = None,
 ) -> str:
     """
     Create an AI Foundry connection with the Databricks PAT.
@@ -127,22 +295,25 @@ def create_ai_foundry_connection(
     Uses Azure REST API to create a Custom Keys connection in the project.
 
     Args:
-        project_client: AI Foundry project client (for compatibility)
+        credential: Azure credential to get a management token
         connection_name: Name for the connection
         databricks_pat: The Databricks PAT token
         subscription_id: Azure subscription ID
         resource_group: Resource group name
         account_name: AI Foundry account name
         project_name: AI Foundry project name
+        token: Prefetched management token; fetched from credential if None
 
     Returns:
         Connection ID
     """
     logger.info("Creating AI Foundry connection: %s", connection_name)
 
-    # Get Azure management token
-    credential = DefaultAzureCredential()
-    token = credential.get_token("https://management.azure.com/.default")
+    # Get Azure management token unless the caller already fetched one
+    if token is None:
+        token = _get_token(
+            credential, "https://management.azure.com/.default"
+        )
 
     # Build connection resource ID
     connection_id = (
@@ -180,7 +351,9 @@ def create_ai_foundry_connection(
         "Content-Type": "application/json",
     }
 
-    response = requests.put(url, json=payload, headers=headers, timeout=30)
+    response = _SESSION.put(
+        url, data=encode_json(payload), headers=headers, timeout=30
+    )
 
     if response.status_code in (200, 201):
         logger.info("✓ Connection created: %s", connection_name)
@@ -194,22 +367,6 @@ def create_ai_foundry_connection(
         raise RuntimeError(error_msg)
 
 
-def load_databricks_openapi_spec() -> dict:
-    """Load the Databricks OpenAPI specification from file."""
-    spec_path = (
-        Path(__file__).parent / "azure_databricks_openapi_spec.json"
-    )
-
-    if not spec_path.exists():
-        raise FileNotFoundError(
-            f"OpenAPI spec not found at {spec_path}. "
-            "Ensure azure_databricks_openapi_spec.json is in this directory."
-        )
-
-    with open(spec_path, "r", encoding="utf-8") as f:
-        return json.load(f)
-
-
 def customize_openapi_spec_for_workspace(
     spec: dict, databricks_workspace_url: str
 ) -> dict:
@@ -217,19 +374,15 @@ def customize_openapi_spec_for_workspace(
     Customize the OpenAPI spec with workspace URL and PAT auth.
 
     Removes Entra ID oauth2 scheme; switches to API key (Bearer token).
+    The spec is modified in place and returned for convenience.
     """
-    customized_spec = spec.copy()
-
     # Update the server URL with the actual workspace
-    if "servers" in customized_spec and len(customized_spec["servers"]) > 0:
-        customized_spec["servers"][0]["url"] = databricks_workspace_url
+    if "servers" in spec and len(spec["servers"]) > 0:
+        spec["servers"][0]["url"] = databricks_workspace_url
 
     # Update security schemes to use API key (Bearer token) instead of oauth2
-    if (
-        "components" in customized_spec
-        and "securitySchemes" in customized_spec["components"]
-    ):
-        customized_spec["components"]["securitySchemes"] = {
+    if "components" in spec and "securitySchemes" in spec["components"]:
+        spec["components"]["securitySchemes"] = {
             "bearerAuth": {
                 "type": "apiKey",
                 "name": "Authorization",
@@ -239,9 +392,10 @@ def customize_openapi_spec_for_workspace(
         }
 
     # Update security to use bearerAuth
-    customized_spec["security"] = [{"bearerAuth": []}]
+    spec["security"] = [{"bearerAuth": []}]
 
-    return customized_spec
+    inline_refs(spec)
+    return spec
 
 
 def register_databricks_openapi_tool(
@@ -257,54 +411,79 @@ def register_databricks_openapi_tool(
     databricks_pat: str | None = None,
     pat_lifetime_days: int = 90,
     pat_comment: str = "AI Foundry Agent",
+    auth_source: str | None = None,
+    managed_identity_client_id: str | None = None,
+    token_cache: bool = False,
 ) -> str:
     """
     Complete setup: Create PAT, create connection, and register agent.
 
     Returns the agent ID.
     """
-    credential = DefaultAzureCredential()
+    # One credential for every token request; constructing another would
+    # re-probe the whole credential chain.
+    credential = build_credential(auth_source, managed_identity_client_id)
+    if token_cache:
+        credential = _PersistentTokenCredential(
+            credential, auth_source, managed_identity_client_id
+        )
     project_client = AIProjectClient(
         credential=credential, endpoint=project_endpoint
     )
 
-    # Step 1: Use provided PAT or create a new one
-    if databricks_pat:
-        if not databricks_pat.strip():
-            raise ValueError("--databricks-pat cannot be empty when provided")
-        logger.info("Using provided Databricks PAT (skipping creation).")
-        pat_token = databricks_pat.strip()
-        pat_source = "provided"
-    else:
-        pat_token = create_databricks_pat(
-            databricks_workspace_url=databricks_workspace_url,
+    client = project_client.agents
+
+    # The management token, the existing-agent lookup and the spec load do
+    # not depend on the PAT, so run them alongside PAT creation.
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        mgmt_token_future = executor.submit(
+            _get_token, credential, "https://management.azure.com/.default"
+        )
+        existing_agent_future = executor.submit(
+            find_agent, client, agent_name
+        )
+        spec_future = executor.submit(
+            customized_spec,
+            customize_openapi_spec_for_workspace,
+            databricks_workspace_url,
+        )
+
+        # Step 1: Use provided PAT or create a new one
+        if databricks_pat:
+            if not databricks_pat.strip():
+                raise ValueError(
+                    "--databricks-pat cannot be empty when provided"
+                )
+            logger.info("Using provided Databricks PAT (skipping creation).")
+            pat_token = databricks_pat.strip()
+            pat_source = "provided"
+        else:
+            pat_token = create_databricks_pat(
+                databricks_workspace_url=databricks_workspace_url,
+                credential=credential,
+                comment=pat_comment,
+                lifetime_days=pat_lifetime_days,
+            )
+            pat_source = "generated"
+
+        # Step 2: Create AI Foundry connection
+        connection_id = create_ai_foundry_connection(
             credential=credential,
-            comment=pat_comment,
-            lifetime_days=pat_lifetime_days,
+            connection_name=connection_name,
+            databricks_pat=pat_token,
+            subscription_id=subscription_id,
+            resource_group=resource_group,
+            account_name=account_name,
+            project_name=project_name,
+            token=mgmt_token_future.result(),
         )
-        pat_source = "generated"
-
-    # Step 2: Create AI Foundry connection
-    connection_id = create_ai_foundry_connection(
-        connection_name=connection_name,
-        databricks_pat=pat_token,
-        subscription_id=subscription_id,
-        resource_group=resource_group,
-        account_name=account_name,
-        project_name=project_name,
-    )
+
+        openapi_spec = spec_future.result()
+        existing_agent = existing_agent_future.result()
 
     # Step 3: Set up OpenAPI tool with connection auth
     logger.info("Setting up Databricks OpenAPI tool...")
 
-    client = project_client.agents
-
-    # Load and customize OpenAPI spec
-    openapi_spec = load_databricks_openapi_spec()
-    openapi_spec = customize_openapi_spec_for_workspace(
-        openapi_spec, databricks_workspace_url
-    )
-
     # Configure connection-based authentication (API key)
     connection_auth = OpenApiConnectionAuthDetails(
         security_scheme=OpenApiConnectionSecurityScheme(
@@ -328,37 +507,42 @@ def register_databricks_openapi_tool(
 
     logger.info("Creating/updating agent: %s", agent_name)
 
-    # Check if agent exists
-    agents = client.list_agents()
-    existing_agent = None
-    for agent in agents:
-        if agent.name == agent_name:
-            existing_agent = agent
-            break
-
-    instructions = (
-        "You are a helpful AI assistant with access to Azure Databricks. "
-        "You can help users interact with Databricks resources including "
-        "clusters, jobs, workspaces and vector search endpoints. "
-        "When users ask about Databricks resources, use the "
-        "databricks_api tool to retrieve information."
-    )
-    if existing_agent:
+    # The digest lets reruns skip re-uploading an unchanged spec
+    tool_json = openapi_tool.as_dict()
+    spec_digest = tool_digest(tool_json)
+    if (
+        existing_agent
+        and (existing_agent.metadata or {}).get("spec_digest") == spec_digest
+        and existing_agent.model == model_deployment_name
+        and existing_agent.instructions == _PAT_INSTRUCTIONS
+    ):
+        logger.info("Agent %s is up to date (no-op)", existing_agent.id)
+        agent = existing_agent
+    elif existing_agent:
         logger.info("Updating existing agent: %s", existing_agent.id)
         agent = client.update_agent(
-            agent_id=existing_agent.id,
-            name=agent_name,
-            model=model_deployment_name,
-            instructions=instructions,
-            tools=[openapi_tool],
+            existing_agent.id,
+            json_body({
+                "name": agent_name,
+                "model": model_deployment_name,
+                "instructions": _PAT_INSTRUCTIONS,
+                "tools": [tool_json],
+                "metadata": {
+                    **(existing_agent.metadata or {}),
+                    "spec_digest": spec_digest,
+                },
+            }),
         )
     else:
         logger.info("Creating new agent")
         agent = client.create_agent(
-            name=agent_name,
-            model=model_deployment_name,
-            instructions=instructions,
-            tools=[openapi_tool],
+            json_body({
+                "name": agent_name,
+                "model": model_deployment_name,
+                "instructions": _PAT_INSTRUCTIONS,
+                "tools": [tool_json],
+                "metadata": {"spec_digest": spec_digest},
+            })
         )
 
     logger.info("Databricks OpenAPI tool registered successfully.")
@@ -379,34 +563,16 @@ def register_databricks_openapi_tool(
         ),
         "pat_source": pat_source,
     }
-    print(json.dumps(config, indent=2))
+    emit_json(config)
 
     return agent.id
 
 
 def main():
-    parser = argparse.ArgumentParser(
-        description="Create AI Foundry agent with Databricks PAT auth"
-    )
-    parser.add_argument(
-        "--ai-foundry-project-endpoint",
-        required=True,
-        help="AI Foundry project endpoint URL",
-    )
-    parser.add_argument(
-        "--ai-model-deployment-name",
-        required=True,
-        help="Azure OpenAI model deployment name (e.g., gpt-4.1)",
-    )
-    parser.add_argument(
-        "--databricks-workspace-url",
-        required=True,
-        help="Databricks workspace URL",
-    )
-    parser.add_argument(
-        "--agent-name",
-        default="DatabricksVectorSearchAgent",
-        help="Name for the agent (default: DatabricksVectorSearchAgent)",
+    parser = build_base_parser(
+        description="Create AI Foundry agent with Databricks PAT auth",
+        debug_help="Enable debug logging and full tracebacks on error",
+        verbose_help="Enable verbose HTTP logging",
     )
     parser.add_argument(
         "--connection-name",
@@ -448,32 +614,24 @@ def main():
         "--databricks-pat",
         help="Use an existing Databricks PAT instead of creating a new one",
     )
-    # Removed legacy skip/bypass PAT flags (script always creates PAT)
-    parser.add_argument(
-        "--debug",
-        action="store_true",
-        help="Enable debug logging",
-    )
     parser.add_argument(
-        "--verbose",
+        "--token-cache",
         action="store_true",
-        help="Enable verbose HTTP logging",
+        help=(
+            "Reuse Azure access tokens across runs via a private cache file "
+            "(~/.cache/ai-foundry-databricks/token.json); the first token of "
+            "each run is still fetched to confirm the signed-in account"
+        ),
     )
+    # Removed legacy skip/bypass PAT flags (script always creates PAT)
 
     args = parser.parse_args()
+    check_auth_args(parser, args)
 
-    if args.debug:
-        logging.getLogger().setLevel(logging.DEBUG)
+    configure_logging(logging.DEBUG if args.debug else logging.INFO)
 
     if args.verbose:
         # Enable HTTP request/response logging
-        import sys
-
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format="%(levelname)s [%(name)s] %(message)s",
-            handlers=[logging.StreamHandler(sys.stdout)],
-        )
         logging.getLogger("azure").setLevel(logging.DEBUG)
 
     try:
@@ -490,6 +648,9 @@ def main():
             databricks_pat=args.databricks_pat,
             pat_lifetime_days=args.pat_lifetime_days,
             pat_comment=args.pat_comment,
+            auth_source=args.auth_source,
+            managed_identity_client_id=args.managed_identity_client_id,
+            token_cache=args.token_cache,
         )
 
         logger.info("Success! Agent ID: %s", agent_id)